@@ -3,7 +3,7 @@ from typing import Optional
 
 import pytorch_lightning as pl
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 
 from continual_ranking.continual_learning.continual_trainer import ContinualTrainer
 from continual_ranking.continual_learning.strategy import Strategy
@@ -13,46 +13,79 @@ logger = logging.getLogger(__name__)
 
 
 class EWC(Strategy):
-    def __init__(self, ewc_lambda: float):
+    def __init__(self, ewc_lambda: float, max_samples: int = 1024):
         super().__init__()
         self.ewc_lambda = ewc_lambda
+        self.max_samples = max_samples
 
-        self.train_dataloader: Optional[DataLoader] = None
+        self._param_refs = []
+        self._means_flat: Optional[torch.Tensor] = None
+        self._fisher_flat: Optional[torch.Tensor] = None
+        self._fisher_scale = 0.0
 
-        self.saved_params = {}
-        self.fisher_matrix = {}
+        self._means = []
+        self._fisher = []
 
     def on_fit_end(self, trainer: ContinualTrainer, pl_module: BiEncoder) -> None:
         if trainer.task_id <= trainer.tasks - 1:
             logger.info(f'Calculating Fisher Matrix for EWC, task: {trainer.task_id}')
 
-            self.saved_params = {}
-            for n, p in pl_module.named_parameters():
-                if p.requires_grad and p is not None:
-                    self.saved_params[n] = p.data
+            self._param_refs = [p for p in pl_module.parameters() if p.requires_grad]
+            means_flat = torch._utils._flatten_dense_tensors([p.detach() for p in self._param_refs])
+            self._means_flat = self._to_host(means_flat)
+            self._means = torch._utils._unflatten_dense_tensors(self._means_flat, self._param_refs)
 
     def calculate_importances(self, trainer: ContinualTrainer, pl_module: BiEncoder, train_dataloader: DataLoader):
-        self.fisher_matrix = {}
-        for n, p in self.saved_params.items():
-            t = torch.zeros_like(p.data)
-            self.fisher_matrix[n] = t
+        fisher_dataloader = self._fisher_dataloader(train_dataloader)
+
+        self._fisher = []
+        self._fisher_flat = None
+        self._fisher_scale = 1 / len(fisher_dataloader)
 
         pl_module.ewc_mode = True
-        pl_module.fisher_matrix = self.fisher_matrix
-        trainer.test(pl_module, train_dataloader)
+        trainer.test(pl_module, fisher_dataloader)
         pl_module.ewc_mode = False
 
-        for n in self.fisher_matrix:
-            self.fisher_matrix[n] /= len(self.train_dataloader)
+        self._fisher_flat = self._to_host(self._fisher_flat.to(torch.bfloat16))
+        self._fisher = torch._utils._unflatten_dense_tensors(self._fisher_flat, self._param_refs)
+
+    @staticmethod
+    def _to_host(tensor: torch.Tensor) -> torch.Tensor:
+        tensor = tensor.cpu()
+        return tensor.pin_memory() if torch.cuda.is_available() else tensor
+
+    def _fisher_dataloader(self, train_dataloader: DataLoader) -> DataLoader:
+        dataset = train_dataloader.dataset
+        if len(dataset) <= self.max_samples:
+            return train_dataloader
+
+        indices = torch.randperm(len(dataset))[:self.max_samples].tolist()
+
+        return DataLoader(
+            Subset(dataset, indices),
+            batch_size=train_dataloader.batch_size,
+            num_workers=train_dataloader.num_workers,
+            collate_fn=train_dataloader.collate_fn,
+            pin_memory=train_dataloader.pin_memory,
+            worker_init_fn=train_dataloader.worker_init_fn,
+        )
 
     @torch.no_grad()
+    def accumulate_fisher(self, pl_module: BiEncoder) -> None:
+        grads = [p.grad if p.grad is not None else torch.zeros_like(p) for p in self._param_refs]
+        grad_flat = torch._utils._flatten_dense_tensors(grads)
+
+        if self._fisher_flat is None:
+            self._fisher_flat = torch.zeros_like(grad_flat)
+
+        self._fisher_flat.addcmul_(grad_flat, grad_flat, value=self._fisher_scale)
+
     def _penalty(self, pl_module: "pl.LightningModule"):
         penalty = 0
-        for n, p in pl_module.named_parameters():
-            if n in self.fisher_matrix:
-                diff = (p - self.saved_params[n].to(pl_module.device)).pow(2)
-                loss = self.fisher_matrix[n].to(pl_module.device) * diff
-                penalty += loss.sum()
+        for p, mean, fisher in zip(self._param_refs, self._means, self._fisher):
+            mean = mean.to(p.device, non_blocking=True)
+            fisher = fisher.to(p.device, non_blocking=True)
+            penalty += (fisher * (p - mean).pow(2)).sum()
         return penalty
 
     def apply_penalty(self, pl_module: BiEncoder, loss: torch.Tensor) -> None:
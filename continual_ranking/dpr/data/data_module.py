@@ -1,20 +1,41 @@
+import gc
 import logging
 import os
-import random
-from typing import Optional, List, Generator, Tuple
+from typing import Optional, List, Generator, Tuple, Callable
 
 import hydra
 import numpy as np
 import pytorch_lightning as pl
 from omegaconf import DictConfig
-from torch.utils.data import DataLoader
+from pytorch_lightning.utilities.seed import pl_worker_init_function
+from torch.utils.data import DataLoader, Dataset
 
 from continual_ranking.dpr.data.file_handler import read_json_file
 from continual_ranking.dpr.data.index_dataset import IndexDataset, IndexTokenizer
-from continual_ranking.dpr.data.train_dataset import TrainDataset, TrainTokenizer
+from continual_ranking.dpr.data.train_dataset import TrainDataset, TrainTokenizer, collate_training_samples
 
 logger = logging.getLogger(__name__)
 
+MAX_WORKERS = 8
+
+
+def available_cpus() -> int:
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def worker_init_fn(worker_id: int) -> None:
+    gc.enable()
+
+    # setting our own init function stops Lightning from adding its worker seeding, so chain it here
+    if int(os.environ.get('PL_SEED_WORKERS', 0)):
+        pl_worker_init_function(worker_id)
+
+
+def shuffled(data: list) -> list:
+    return [data[i] for i in np.random.permutation(len(data))]
+
 
 class DataPaths:
     def __init__(self, cfg: DictConfig):
@@ -38,9 +59,39 @@ class DataModule(pl.LightningDataModule):
 
         self.train_sets = None
         self.eval_sets = None
+        self.index_set: Optional[IndexDataset] = None
+        self.test_set: Optional[TrainDataset] = None
         self.strategy = self.cfg.experiment.strategy
 
         self.train_tokenizer = TrainTokenizer(self.cfg.biencoder.sequence_length)
+        self.num_workers = self._auto_workers()
+
+    def _auto_workers(self) -> int:
+        num_workers = min(self.cfg.biencoder.num_workers or 0, max(1, available_cpus() - 2), MAX_WORKERS)
+        logger.info(f'Using {num_workers} dataloader workers (configured: {self.cfg.biencoder.num_workers})')
+        return num_workers
+
+    def _make_dataloader(
+            self,
+            dataset: Dataset,
+            batch_size: int,
+            collate_fn: Optional[Callable] = None,
+            persistent_workers: bool = True
+    ) -> DataLoader:
+        if self.num_workers > 0:
+            workers_kwargs = {'persistent_workers': persistent_workers, 'prefetch_factor': 4}
+        else:
+            workers_kwargs = {}
+
+        return DataLoader(
+            dataset,
+            batch_size=batch_size,
+            num_workers=self.num_workers,
+            collate_fn=collate_fn,
+            pin_memory=self.cfg.device == 'gpu',
+            worker_init_fn=worker_init_fn,
+            **workers_kwargs
+        )
 
     def _read_training_data(self, is_train: bool) -> Tuple[List[dict], List[dict]]:
         if is_train:
@@ -61,8 +112,7 @@ class DataModule(pl.LightningDataModule):
         base_set = base_data[:base_size]
         cl_set = cl_data[:max(cl_sizes)]
 
-        data = base_set + cl_set
-        random.shuffle(data)
+        data = shuffled(base_set + cl_set)
 
         return [data]
 
@@ -88,10 +138,7 @@ class DataModule(pl.LightningDataModule):
         else:
             datasets = [chunk[len(replay):] + replay for chunk, replay in zip(datasets, replays)]
 
-        for dataset in datasets[1:]:
-            random.shuffle(dataset)
-
-        return datasets
+        return [datasets[0], *(shuffled(dataset) for dataset in datasets[1:])]
 
     def _make_set_splits(self, batch_size: int, split_size: float = 0) -> Generator[DataLoader, None, None]:
         base_size = self.cfg.experiment.base_size
@@ -115,62 +162,60 @@ class DataModule(pl.LightningDataModule):
 
         for d in datasets:
             dataset = TrainDataset(d, self.cfg.negatives_amount, self.train_tokenizer)
-            yield DataLoader(
-                dataset,
-                batch_size=batch_size,
-                num_workers=self.cfg.biencoder.num_workers
-            )
+            yield self._make_dataloader(dataset, batch_size, collate_training_samples)
 
     def make_forgetting_dataset(self) -> DataLoader:
         base_data = read_json_file(self.paths.train_base)
         base_set = base_data[:self.cfg.experiment.base_size]
         dataset = TrainDataset(base_set, self.cfg.negatives_amount, self.train_tokenizer)
-        return DataLoader(
-            dataset,
-            batch_size=self.cfg.biencoder.val_batch_size,
-            num_workers=self.cfg.biencoder.num_workers
+        return self._make_dataloader(
+            dataset, self.cfg.biencoder.val_batch_size, collate_training_samples, persistent_workers=False
         )
 
     def setup(self, stage: Optional[str] = None):
         self.train_sets = self._make_set_splits(self.cfg.biencoder.train_batch_size)
         self.eval_sets = self._make_set_splits(self.cfg.biencoder.val_batch_size, self.cfg.datasets.split_size)
 
+        if self.index_set is None:
+            self.index_set = self._make_index_set()
+
+        if self.test_set is None:
+            self.test_set = self._make_test_set()
+
     def prepare_data(self) -> None:
         pass
 
-    def train_dataloader(self) -> List[DataLoader]:
+    def train_dataloader(self) -> Generator[DataLoader, None, None]:
         return self.train_sets
 
-    def val_dataloader(self) -> List[DataLoader]:
+    def val_dataloader(self) -> Generator[DataLoader, None, None]:
         return self.eval_sets
 
-    def index_dataloader(self) -> DataLoader:
+    def _make_index_set(self) -> IndexDataset:
+        logger.info('Tokenizing index dataset')
         index_tokenizer = IndexTokenizer(self.cfg.biencoder.sequence_length)
         data = []
         data.extend(read_json_file(self.paths.index_base))
         data.extend(read_json_file(self.paths.index_cl))
 
-        random.shuffle(data)
+        data = shuffled(data)
 
-        index_set = IndexDataset(data, index_tokenizer)
+        return IndexDataset(data, index_tokenizer)
 
-        return DataLoader(
-            index_set,
-            batch_size=self.cfg.biencoder.index_batch_size,
-            num_workers=self.cfg.biencoder.num_workers
-        )
+    def index_dataloader(self) -> DataLoader:
+        return self._make_dataloader(self.index_set, self.cfg.biencoder.index_batch_size, persistent_workers=False)
 
-    def test_dataloader(self) -> DataLoader:
+    def _make_test_set(self) -> TrainDataset:
+        logger.info('Tokenizing test dataset')
         data = []
         data.extend(read_json_file(self.paths.test_base))
         data.extend(read_json_file(self.paths.test_cl))
 
-        random.shuffle(data)
+        data = shuffled(data)
 
-        test_set = TrainDataset(data, self.cfg.negatives_amount, self.train_tokenizer)
+        return TrainDataset(data, self.cfg.negatives_amount, self.train_tokenizer)
 
-        return DataLoader(
-            test_set,
-            batch_size=self.cfg.biencoder.test_batch_size,
-            num_workers=self.cfg.biencoder.num_workers
+    def test_dataloader(self) -> DataLoader:
+        return self._make_dataloader(
+            self.test_set, self.cfg.biencoder.test_batch_size, collate_training_samples, persistent_workers=False
         )
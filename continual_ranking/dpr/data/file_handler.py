@@ -1,12 +1,13 @@
 import json
 import pickle
 
+import orjson
 from torch import Tensor
 
 
 def read_json_file(path: str) -> list:
-    with open(path, mode='r') as f:
-        data = json.load(f)
+    with open(path, mode='rb') as f:
+        data = orjson.loads(f.read())
     return data
 
 
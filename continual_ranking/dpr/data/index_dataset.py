@@ -2,17 +2,10 @@ import logging
 from collections import namedtuple
 from typing import List, Union
 
-import numpy as np
 import torch
 from torch.utils.data import Dataset
 
-from continual_ranking.dpr.data.tokenizer import Tokenizer, SimpleTokenizer
-
-IndexSample = namedtuple(
-    'IndexSample', [
-        'ctxs',
-    ]
-)
+from continual_ranking.dpr.data.tokenizer import Tokenizer
 
 TokenizedIndexSample = namedtuple(
     'TokenizedIndexSample', [
@@ -29,44 +22,39 @@ class IndexTokenizer:
     def __init__(self, max_length: int):
         self.tokenizer = Tokenizer(max_length)
 
-    def __call__(self, sample: IndexSample) -> TokenizedIndexSample:
-        index_tokens = self.tokenizer(sample.ctxs)
+    def tokenize_all(self, ctxs: List[str]) -> TokenizedIndexSample:
+        index_tokens = self.tokenizer.tokenize_all(ctxs)
 
         return TokenizedIndexSample(
-            index_tokens['input_ids'].view(-1),
-            index_tokens['token_type_ids'].view(-1),
-            index_tokens['attention_mask'].view(-1)
+            index_tokens['input_ids'],
+            index_tokens['token_type_ids'],
+            index_tokens['attention_mask']
         )
 
 
 class IndexDataset(Dataset):
 
-    def __init__(self, data: List[dict], tokenizer: Union[IndexTokenizer, SimpleTokenizer]):
-        self.data = np.array(data)
-        self.tokenizer = tokenizer
+    def __init__(self, data: List[dict], tokenizer: IndexTokenizer):
+        tokens = tokenizer.tokenize_all([d['ctxs'] for d in data])
+
+        self.input_ids = tokens.input_ids
+        self.token_type_ids = tokens.token_type_ids
+        self.attention_mask = tokens.attention_mask
 
     def __len__(self) -> int:
-        return len(self.data)
+        return len(self.input_ids)
 
-    def __getitem__(self, idx) -> Union[TokenizedIndexSample, List[torch.Tensor]]:
-        try:
-            return self._get_single(idx)
-        except (IndexError, AttributeError, TypeError):
+    def __getitem__(self, idx) -> Union[TokenizedIndexSample, torch.Tensor]:
+        if isinstance(idx, torch.Tensor) and idx.dim() > 0:
             return self._get_multiple(idx)
+        return self._get_single(idx)
 
     def _get_single(self, idx: int) -> TokenizedIndexSample:
-        json_sample = self.data[idx]
-
-        sample = IndexSample(
-            json_sample['ctxs'],
+        return TokenizedIndexSample(
+            self.input_ids[idx].long(),
+            self.token_type_ids[idx].long(),
+            self.attention_mask[idx].long(),
         )
 
-        sample = self.tokenizer(sample)
-
-        return sample
-
-    def _get_multiple(self, idx: torch.Tensor) -> List[torch.Tensor]:
-        idx = idx.to('cpu')
-        data = self.data[idx]
-        data = self.tokenizer([d['ctxs'] for d in data])
-        return data
+    def _get_multiple(self, idx: torch.Tensor) -> torch.Tensor:
+        return self.input_ids[idx.to('cpu')].long()
@@ -1,11 +1,13 @@
-from typing import List, Union
+from typing import Dict, List, Union
 
-from transformers import BertTokenizer
+import torch
+from torch import Tensor
+from transformers import BertTokenizerFast
 
 
 class Tokenizer:
     def __init__(self, max_length: int):
-        self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased', do_lower_case=True)
+        self.tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased', do_lower_case=True)
         self.max_length = max_length
         self.pad_to_max = True
 
@@ -21,10 +23,28 @@ class Tokenizer:
 
         return tokens
 
+    def tokenize_all(self, texts: List[str], chunk_size: int = 10_000) -> Dict[str, Tensor]:
+        if not texts:
+            return {
+                'input_ids':      torch.zeros((0, self.max_length), dtype=torch.int32),
+                'token_type_ids': torch.zeros((0, self.max_length), dtype=torch.uint8),
+                'attention_mask': torch.zeros((0, self.max_length), dtype=torch.uint8),
+            }
+
+        tokens = {'input_ids': [], 'token_type_ids': [], 'attention_mask': []}
+
+        for i in range(0, len(texts), chunk_size):
+            chunk_tokens = self(texts[i:i + chunk_size])
+            tokens['input_ids'].append(chunk_tokens['input_ids'].int())
+            tokens['token_type_ids'].append(chunk_tokens['token_type_ids'].to(torch.uint8))
+            tokens['attention_mask'].append(chunk_tokens['attention_mask'].to(torch.uint8))
+
+        return {key: torch.cat(value) for key, value in tokens.items()}
+
 
 class SimpleTokenizer:
     def __init__(self, max_length: int):
-        self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased', do_lower_case=True)
+        self.tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased', do_lower_case=True)
         self.max_length = max_length
 
     def __call__(self, text: Union[str, List[str]]):
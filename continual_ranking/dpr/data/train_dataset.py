@@ -1,20 +1,15 @@
 import random
-from collections import namedtuple, defaultdict
-from typing import List
+from collections import namedtuple
+from typing import Dict, List, Tuple
 
+import numpy as np
 import torch
+from torch import Tensor
 from torch.utils.data import Dataset
+from torch.utils.data.dataloader import default_collate
 
 from continual_ranking.dpr.data.tokenizer import Tokenizer
 
-TrainingSample = namedtuple(
-    'TrainingSample', [
-        'query',
-        'positive_passages',
-        'negative_passages'
-    ]
-)
-
 TokenizedTrainingSample = namedtuple(
     'TokenizedTrainingSample', [
         'question_ids',
@@ -31,25 +26,21 @@ class TrainTokenizer:
     def __init__(self, max_length: int):
         self.tokenizer = Tokenizer(max_length)
 
-    def __call__(self, sample: TrainingSample) -> TokenizedTrainingSample:
-        query_tokens = self.tokenizer(sample.query)
+    def __call__(self, passages: List[List[str]]) -> Tuple[Dict[str, Tensor], np.ndarray]:
+        offsets = np.cumsum([0, *(len(p) for p in passages)])
+        tokens = self.tokenizer.tokenize_all([text for p in passages for text in p])
 
-        ctx_tokens = defaultdict(list)
+        return tokens, offsets
 
-        for ctx in sample.positive_passages + sample.negative_passages:
-            tokens = self.tokenizer(ctx)
-            ctx_tokens['input_ids'].append(tokens['input_ids'].view(-1))
-            ctx_tokens['token_type_ids'].append(tokens['token_type_ids'].view(-1))
-            ctx_tokens['attention_mask'].append(tokens['attention_mask'].view(-1))
 
-        return TokenizedTrainingSample(
-            query_tokens['input_ids'].view(-1),
-            query_tokens['token_type_ids'].view(-1),
-            query_tokens['attention_mask'].view(-1),
-            torch.stack(ctx_tokens['input_ids']),
-            torch.stack(ctx_tokens['token_type_ids']),
-            torch.stack(ctx_tokens['attention_mask']),
-        )
+def collate_training_samples(samples: List[TokenizedTrainingSample]) -> TokenizedTrainingSample:
+    batch = default_collate(samples)
+
+    return batch._replace(
+        context_ids=batch.context_ids.flatten(0, 1),
+        ctx_segments=batch.ctx_segments.flatten(0, 1),
+        ctx_attn_mask=batch.ctx_attn_mask.flatten(0, 1),
+    )
 
 
 class TrainDataset(Dataset):
@@ -57,40 +48,50 @@ class TrainDataset(Dataset):
     def __init__(self, data: List[dict], negatives_amount: int, tokenizer: TrainTokenizer):
         self.data = data
         self.negatives_amount = negatives_amount
-        self.tokenizer = tokenizer
+
+        self.questions, _ = tokenizer([[sample['question']] for sample in data])
+        self.positives, self.positive_offsets = tokenizer([sample['positive_ctxs'] for sample in data])
+        self.negatives, self.negative_offsets = tokenizer([sample['negative_ctxs'] for sample in data])
 
     def __len__(self) -> int:
         return len(self.data)
 
     def __getitem__(self, idx) -> TokenizedTrainingSample:
-        json_sample = self.data[idx]
+        positives = torch.arange(int(self.positive_offsets[idx]), int(self.positive_offsets[idx + 1]))
+        negatives = torch.tensor(self._find_negatives(idx), dtype=torch.long)
 
-        negatives = self._find_negatives(json_sample)
+        contexts = [
+            torch.cat([self.positives[key][positives], self.negatives[key][negatives]]).long()
+            for key in ('input_ids', 'token_type_ids', 'attention_mask')
+        ]
 
-        sample = TrainingSample(
-            json_sample['question'],
-            json_sample['positive_ctxs'],
-            negatives
+        return TokenizedTrainingSample(
+            self.questions['input_ids'][idx].long(),
+            self.questions['token_type_ids'][idx].long(),
+            self.questions['attention_mask'][idx].long(),
+            *contexts
         )
 
-        sample = self.tokenizer(sample)
-
-        return sample
+    def _find_negatives(self, idx: int) -> List[int]:
+        first, last = int(self.negative_offsets[idx]), int(self.negative_offsets[idx + 1])
 
-    def _find_negatives(self, sample: dict):
-        if self.negatives_amount == len(sample['negative_ctxs']):
-            return sample['negative_ctxs']
+        if self.negatives_amount == last - first:
+            return list(range(first, last))
 
         elif self.negatives_amount > 1:
-            negatives = random.sample(self.data, self.negatives_amount)
-            negatives = [i['negative_ctxs'][0] for i in negatives]
-
-            current_negative = sample['negative_ctxs']
-
-            if current_negative not in negatives:
-                negatives[0] = current_negative[0]
+            drawn = random.sample(range(len(self.data)), self.negatives_amount)
+            negatives = [self._first_negative(i) for i in drawn]
+            negatives[0] = self._first_negative(idx)
 
             return negatives
 
         else:
-            return sample['negative_ctxs']
+            return list(range(first, last))
+
+    def _first_negative(self, idx: int) -> int:
+        first, last = int(self.negative_offsets[idx]), int(self.negative_offsets[idx + 1])
+
+        if last <= first:
+            raise IndexError(f'Sample {idx} has no negative contexts')
+
+        return first
@@ -45,7 +45,6 @@ class Evaluator:
     def _k_docs(self) -> None:
         tokenizer = SimpleTokenizer(self.max_length)
 
-        self.index_dataset.tokenizer = tokenizer
         test_encoded = pickle_load(self.test_path).to(self.device)
 
         test_answers = [i['positive_ctxs'][0] for i in self.test_dataset.data]
@@ -17,7 +17,8 @@ logger = logging.getLogger(__name__)
 
 
 def dot_product(q_vectors: Tensor, ctx_vectors: Tensor) -> Tensor:
-    return torch.matmul(q_vectors, torch.transpose(ctx_vectors, 0, 1))
+    with torch.autocast(device_type=q_vectors.device.type, enabled=False):
+        return torch.mm(q_vectors.float(), ctx_vectors.float().t())
 
 
 class BiEncoder(pl.LightningModule):
@@ -53,8 +54,6 @@ class BiEncoder(pl.LightningModule):
         self.ewc_mode = False
         self.ewc = None
 
-        self.fisher_matrix = {}
-
     def log_metrics(self, metrics: dict):
         for key, value in metrics.items():
             self.log(key, value)
@@ -66,27 +65,27 @@ class BiEncoder(pl.LightningModule):
             batch.question_attn_mask,
         )
 
-        context_ids = torch.cat([ctx for ctx in batch.context_ids], dim=0)
-        ctx_segments = torch.cat([ctx for ctx in batch.ctx_segments], dim=0)
-        ctx_attn_mask = torch.cat([ctx for ctx in batch.ctx_attn_mask], dim=0)
-
         ctx_pooled_out = self.context_model.forward(
-            context_ids,
-            ctx_segments,
-            ctx_attn_mask
+            batch.context_ids,
+            batch.ctx_segments,
+            batch.ctx_attn_mask
         )
 
         return q_pooled_out, ctx_pooled_out
 
     def configure_optimizers(self) -> Optimizer:
-        no_decay = ["bias", "LayerNorm.weight"]
+        no_decay = ("bias", "LayerNorm.weight")
+        decay_params, no_decay_params = [], []
+        for n, p in self.named_parameters():
+            (no_decay_params if any(nd in n for nd in no_decay) else decay_params).append(p)
+
         parameters = [
             {
-                "params":       [p for n, p in self.named_parameters() if not any(nd in n for nd in no_decay)],
+                "params":       decay_params,
                 "weight_decay": self.cfg.biencoder.weight_decay,
             },
             {
-                "params":       [p for n, p in self.named_parameters() if any(nd in n for nd in no_decay)],
+                "params":       no_decay_params,
                 "weight_decay": 0.0,
             },
         ]
@@ -94,33 +93,28 @@ class BiEncoder(pl.LightningModule):
         return optimizer
 
     @staticmethod
-    def calculate_loss(q_vectors: Tensor, ctx_vectors: Tensor, positive_ctx_indices: list):
+    def calculate_loss(q_vectors: Tensor, ctx_vectors: Tensor, positive_ctx_indices: Tensor):
         scores = dot_product(q_vectors, ctx_vectors)
 
         if len(q_vectors.size()) > 1:
             q_num = q_vectors.size(0)
             scores = scores.view(q_num, -1)
 
-        softmax_scores = F.log_softmax(scores, dim=1)
-
-        loss = F.nll_loss(
-            softmax_scores,
-            torch.tensor(positive_ctx_indices).to(softmax_scores.device),
-        )
+        loss = F.cross_entropy(scores, positive_ctx_indices)
 
-        max_score, max_idxs = torch.max(softmax_scores, 1)
-        correct_predictions = (max_idxs == torch.tensor(positive_ctx_indices).to(max_idxs.device)).sum()
+        correct_predictions = (scores.argmax(1) == positive_ctx_indices).sum()
 
-        return loss, correct_predictions.sum().detach().item()
+        return loss, correct_predictions.detach()
 
     def shared_step(self, batch: TokenizedTrainingSample, batch_idx, log=True):
         if log:
             self.log('experiment_id', float(self.experiment_id))
-            self.log('global_step', float(self.global_step))
 
         q_pooled_out, ctx_pooled_out = self.forward(batch)
 
-        positives_idx = [x for x in range(ctx_pooled_out.shape[0]) if x % (1 + self.cfg.negatives_amount) == 0]
+        positives_idx = torch.arange(
+            0, ctx_pooled_out.shape[0], 1 + self.cfg.negatives_amount, device=ctx_pooled_out.device
+        )
 
         loss, correct_predictions = self.calculate_loss(q_pooled_out, ctx_pooled_out, positives_idx)
 
@@ -160,7 +154,7 @@ class BiEncoder(pl.LightningModule):
             batch.attention_mask,
         )
 
-        self.index.append(index_pooled_out.to('cpu').detach())
+        self.index.append(index_pooled_out.to('cpu', torch.float32).detach())
 
         self.index_size += 1
 
@@ -184,7 +178,7 @@ class BiEncoder(pl.LightningModule):
             metric = 'forgetting/loss_epoch'
         else:
             metric = 'test/loss_epoch'
-            self.test.append(q_pooled_out.to('cpu').detach())
+            self.test.append(q_pooled_out.to('cpu', torch.float32).detach())
 
         self.log(metric, test_loss)
 
@@ -195,10 +189,7 @@ class BiEncoder(pl.LightningModule):
             self.zero_grad()
             ewc_loss, _, _ = self.shared_step(batch, batch_idx, False)
             ewc_loss.backward()
-
-            for n, p in self.named_parameters():
-                if n in self.fisher_matrix and p.grad is not None:
-                    self.fisher_matrix[n].data += p.grad.data.to('cpu').clone().pow(2)
+            self.ewc.accumulate_fisher(self)
 
         return ewc_loss
 
@@ -210,9 +201,6 @@ class BiEncoder(pl.LightningModule):
         else:
             self._test_step(batch, batch_idx)
 
-    def on_after_backward(self) -> None:
-        torch.nn.utils.clip_grad_norm_(self.parameters(), self.cfg.biencoder.max_grad_norm)
-
     def on_train_epoch_start(self) -> None:
         self.train_acc_roll = 0
 
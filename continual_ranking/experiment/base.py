@@ -5,6 +5,7 @@ from abc import abstractmethod
 from typing import Optional, List, Union, Any, Iterable
 
 import pytorch_lightning as pl
+import torch
 import wandb
 from omegaconf import DictConfig
 from pytorch_lightning.callbacks import EarlyStopping
@@ -29,8 +30,8 @@ class Base:
 
         self.model: Optional[BiEncoder] = None
         self.datamodule: Optional[DataModule] = None
-        self.train_dataloader: Union[DataLoader, List[DataLoader]] = []
-        self.val_dataloader: Union[DataLoader, List[DataLoader]] = []
+        self.train_dataloader: Iterable[DataLoader] = []
+        self.val_dataloader: Iterable[DataLoader] = []
         self.trainer: Optional[Union[ContinualTrainer, Any]] = None
         self.strategies: Optional[Iterable[pl.Callback]] = None
 
@@ -103,6 +104,11 @@ class Base:
 
     def setup_trainer(self) -> None:
         logger.info('Setting up trainer')
+        precision = self.cfg.biencoder.precision
+        if precision == 'bf16' and self.cfg.device == 'gpu' and not torch.cuda.is_bf16_supported():
+            logger.warning('bf16 is not supported on this GPU, falling back to fp32')
+            precision = 32
+
         self.trainer = ContinualTrainer(
             tasks=len(self.cfg.experiment.cl_sizes),
             max_epochs=self.cfg.biencoder.max_epochs,
@@ -110,6 +116,9 @@ class Base:
             gpus=-1 if self.cfg.device == 'gpu' else 0,
             deterministic=True,
             auto_lr_find=True,
+            gradient_clip_val=self.cfg.biencoder.max_grad_norm,
+            gradient_clip_algorithm='norm',
+            precision=precision,
             logger=self.loggers,
             callbacks=self.callbacks,
             fast_dev_run=self.fast_dev_run,
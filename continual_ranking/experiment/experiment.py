@@ -1,3 +1,4 @@
+import gc
 import logging
 import time
 from typing import Optional
@@ -59,7 +60,7 @@ class Experiment(Base):
             self.trainer.task_id = self.experiment_id
 
             start = time.time()
-            self.trainer.fit(self.model, train_dataloader, val_dataloader)
+            self._fit(train_dataloader, val_dataloader)
             self._continual_strategies(train_dataloader)
             experiment_time = time.time() - start
 
@@ -71,13 +72,24 @@ class Experiment(Base):
             with torch.no_grad():
                 self._evaluate()
 
+            gc.collect()
+            torch.cuda.empty_cache()
+
             self.trainer.save_checkpoint(f'{self.experiment_name}_{self.trainer.task_id}.ckpt')
 
         self.wandb_log({'training_time': self.training_time})
 
+    def _fit(self, train_dataloader: DataLoader, val_dataloader: DataLoader) -> None:
+        gc.disable()
+        try:
+            self.trainer.fit(self.model, train_dataloader, val_dataloader)
+        finally:
+            gc.enable()
+
+        gc.collect()
+
     def _continual_strategies(self, train_dataloader: DataLoader):
         if self.ewc and self.trainer.task_id < self.trainer.tasks:
-            self.ewc.train_dataloader = train_dataloader
             self.ewc.calculate_importances(self.trainer, self.model, train_dataloader)
 
     def _index(self, index_dataloader: DataLoader) -> None:
@@ -138,7 +150,6 @@ class Experiment(Base):
 
     def _evaluate(self) -> None:
         self.alert(title=f'Evaluation for {self.experiment_name} #{self.experiment_id} started!')
-        torch.cuda.empty_cache()
 
         index_dataloader = self.datamodule.index_dataloader()
         test_dataloader = self.datamodule.test_dataloader()
@@ -165,4 +176,3 @@ class Experiment(Base):
             title=f'Evaluation finished!',
             text=f'```{scores}```'
         )
-        torch.cuda.empty_cache()